@@ -5,11 +5,98 @@
 
 # Importing the necessary libraries
 import requests
+import orjson
 import os
 import json
 import time
 import re
+import hashlib
+import functools
+import heapq
+import logging
+import threading
+from operator import itemgetter
 from dotenv import load_dotenv
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+_log = logging.getLogger(__name__)
+
+###########################################################
+# Shared HTTP session
+# A single pooled session so every Spotify call reuses keep-alive
+# connections instead of opening a new TCP+TLS connection per request.
+# The Retry policy is the one place rate-limit (429) and transient 5xx
+# backoff is handled -- urllib3 honours Retry-After automatically.
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=32,
+        max_retries=Retry(
+            total=8,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            respect_retry_after_header=True,
+            allowed_methods=frozenset(["GET", "POST"]),
+        ),
+    ),
+)
+
+# Bound on concurrent requests, to stay under Spotify's rate limit.
+_MAX_WORKERS = 10
+
+# Access-token cache: client-credentials tokens live for ~3600s, so
+# reuse one until it is close to expiry instead of re-authenticating.
+_TOKEN_CACHE = {}   # (client_id, client_secret) -> (token, expiry)
+_TOKEN_LOCK = threading.Lock()
+
+# Conditional-request caches: when Spotify returns an ETag, the next
+# request sends If-None-Match and a 304 reuses the parsed body. When it
+# doesn't, a digest of the raw bytes at least skips re-parsing
+# byte-identical responses.
+_ETAG_CACHE = {}    # url -> (etag, parsed response)
+_DIGEST_CACHE = {}  # url -> (blake2b digest, parsed response)
+
+###########################################################
+# Project paths, resolved once at import instead of per call
+_BASE_DIR = Path(__file__).resolve().parent.parent
+_DEFAULT_RAW_DIR = _BASE_DIR / "data/raw"
+_created_dirs = set()  # folders save_json has already ensured exist
+
+###########################################################
+# On-disk response cache
+# Playlist metadata and artist genres are effectively static over a
+# run's lifetime, so repeated calls across runs only cost a json.load.
+_CACHE_DIR = str(_BASE_DIR / "data/cache/spotify")
+_PLAYLIST_TTL = 24 * 60 * 60      # playlist metadata: 24h
+_ARTIST_TTL = 7 * 24 * 60 * 60    # artist genres essentially never change: 7d
+
+def _cache_key(url, params=None):
+    """Build a stable cache key from the request URL and query params."""
+    raw = url + json.dumps(sorted((params or {}).items()))
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+def _cache_get(key, ttl):
+    """Return the cached JSON for `key` if it exists and is younger than `ttl`."""
+    path = os.path.join(_CACHE_DIR, f"{key}.json")
+    try:
+        if time.time() - os.path.getmtime(path) > ttl:
+            return None
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+def _cache_set(key, value):
+    """Store `value` (response JSON) on disk under `key`."""
+    os.makedirs(_CACHE_DIR, exist_ok=True)
+    path = os.path.join(_CACHE_DIR, f"{key}.json")
+    with open(path, "wb") as f:
+        f.write(orjson.dumps(value))
 
 ###########################################################
 # Function: get_spotify_token
@@ -17,6 +104,9 @@ def get_spotify_token(client_id, client_secret):
     """
     A function that authenticates with Spotify API and get an access token.
 
+    A cached token is returned as long as it has more than 60 seconds
+    of life left, so long-running callers don't re-authenticate per call.
+
     Params:
         client_id (str): Spotify API client ID.
         client_secret (str): Spotify API client secret.
@@ -24,16 +114,33 @@ def get_spotify_token(client_id, client_secret):
     Returns:
         str: Spotify API access token.
     """
-    url = "https://accounts.spotify.com/api/token"
-    data = {"grant_type": "client_credentials"}
-    response = requests.post(url, data=data, auth=(client_id, client_secret))
-    response.raise_for_status()
-    return response.json()["access_token"]
+    with _TOKEN_LOCK:
+        cached = _TOKEN_CACHE.get((client_id, client_secret))
+        if cached is not None:
+            token, expiry = cached
+            if expiry - time.monotonic() > 60:
+                _SESSION.headers["Authorization"] = f"Bearer {token}"
+                return token
+
+        url = "https://accounts.spotify.com/api/token"
+        data = {"grant_type": "client_credentials"}
+        response = _SESSION.post(url, data=data, auth=(client_id, client_secret))
+        response.raise_for_status()
+        payload = orjson.loads(response.content)
+
+        token = payload["access_token"]
+        expiry = time.monotonic() + payload.get("expires_in", 3600)
+        _TOKEN_CACHE[(client_id, client_secret)] = (token, expiry)
+
+        # Set the auth header once on the session so each call doesn't have
+        # to rebuild its own headers dict.
+        _SESSION.headers["Authorization"] = f"Bearer {token}"
+        return token
 
 ###########################################################
 # Function: get_spotify_playlist
 
-def search_playlists(query, token, limit=10, min_tracks=10, min_followers=50):
+def search_playlists(query, token, limit=10, min_tracks=10, min_followers=50, top_k=None):
     """
     A function to search for playlists using the Spotify API with more flexible searching
 
@@ -43,6 +150,7 @@ def search_playlists(query, token, limit=10, min_tracks=10, min_followers=50):
         limit (int): Number of playlists to retrieve (default 10).
         min_tracks (int): Minimum number of tracks a playlist must have (default 10)
         min_followers (int): Minimum number of followers a playlist must have (default 50)
+        top_k (int): If set, return only the K playlists with the most followers
 
     Returns:
         list: Sorted list of playlist IDs by followers.
@@ -50,33 +158,46 @@ def search_playlists(query, token, limit=10, min_tracks=10, min_followers=50):
     time_periods = ["morning", "afternoon", "evening", "night"]
     excluded_terms = [term for term in time_periods if term.lower() != query.lower()]
 
-    # Construct more flexible search queries
-    search_variations = [
-        f"{query} playlist",
-        f"*{query}*",
-        f"{query} music",
-        f"{query} vibes"
-    ]
+    # Pre-compile the excluded-term check into a single union regex so
+    # the inner loop does one search per playlist instead of one per term
+    excluded_re = re.compile(
+        r'\b(' + '|'.join(map(re.escape, excluded_terms)) + r')\b', re.IGNORECASE
+    )
+
+    # One OR-joined query replaces the former four near-identical search
+    # variations -- a single round-trip returns a superset of their results
+    search_query = f'{query} OR "{query} playlist" OR "{query} music" OR "{query} vibes"'
+    page_limit = min(50, limit * 4)  # Spotify caps search pages at 50
 
     valid_playlists = []
     seen_playlist_ids = set() # to prevent duplicates
 
-    for search_query in search_variations:
+    def _run_search(offset):
         url = "https://api.spotify.com/v1/search"
-        headers = {"Authorization": f"Bearer {token}"}
         params = {
-            "q": search_query, 
-            "type": "playlist", 
-            "limit": limit
+            "q": search_query,
+            "type": "playlist",
+            "limit": page_limit,
+            "offset": offset
         }
-        
-        response = requests.get(url, headers=headers, params=params)
+        response = _SESSION.get(url, params=params)
         response.raise_for_status()
+        return orjson.loads(response.content)
+
+    search_results = [_run_search(0)]
 
-        playlists = response.json()
+    # A full first page suggests more matches, so pull one more page
+    first_items = search_results[0].get("playlists", {}).get("items", [])
+    if len(first_items) == page_limit == 50:
+        search_results.append(_run_search(50))
+
+    # Filter locally first, collecting candidates whose follower counts
+    # still need to be fetched.
+    candidates = []
+    for playlists in search_results:
         if "playlists" not in playlists or "items" not in playlists["playlists"]:
             continue
-    
+
         for playlist in playlists["playlists"]["items"]:
             try:
                 # Skip if playlist is None
@@ -87,55 +208,82 @@ def search_playlists(query, token, limit=10, min_tracks=10, min_followers=50):
                 if "name" not in playlist or "tracks" not in playlist:
                     continue
 
+                # Skip anything seen in an earlier result page --
+                # marking the ID up front (even when a filter below
+                # rejects it) so negative results aren't re-checked
+                playlist_id = playlist["id"]
+                if playlist_id in seen_playlist_ids:
+                    continue
+                seen_playlist_ids.add(playlist_id)
+
+                # Run the cheapest predicates first so rejected playlists
+                # never reach the regex (or, later, the details fetch)
+
                 # Filter out Spotify-generated playlists
                 if playlist.get("owner", {}).get("id") == "spotify":
                     continue
 
-                # Check if title contains any excluded terms
-                if any(re.search(rf'\b{term}\b', playlist["name"], re.IGNORECASE) for term in excluded_terms):
+                # To remove artist tour setlists
+                if "setlist" in playlist["name"].lower():
                     continue
-                
+
                 # Check minimum track count
                 if playlist["tracks"].get("total", 0) < min_tracks:
                     continue
 
-                # To remove artist tour setlists
-                if "setlist" in playlist.get("name", "").lower():
-                    continue
-
-                # Fetch additional details for followers
-                playlist_id = playlist["id"]
-                if playlist_id in seen_playlist_ids:  # Skip duplicates
+                # Check if title contains any excluded terms
+                if excluded_re.search(playlist["name"]):
                     continue
 
-                details = get_playlist_details(playlist_id, token)
-                if details and "followers" in details:
-                    followers = details["followers"]["total"]
-                    if followers < min_followers:
-                        continue
-                    playlist["followers"] = followers
-                    valid_playlists.append(playlist)
-                    seen_playlist_ids.add(playlist_id)
+                candidates.append(playlist)
 
             except Exception as e:
-                print(f"Error processing playlist: {str(e)}")
-
-    # Sort playlists by followers
-    sorted_playlists = sorted(valid_playlists, key=lambda x: x["followers"], reverse=True)
-
-    # Debugging: Print sorted playlists
-    print("Filtered and Sorted Playlists:")
-    for playlist in sorted_playlists:
-        print(f"{playlist['name']} - Followers: {playlist.get('followers', 0)} - Tracks: {playlist['tracks']['total']}")
+                _log.warning("Error processing playlist: %s", e)
+
+    # Fetch follower details for every surviving candidate concurrently
+    with ThreadPoolExecutor(max_workers=_MAX_WORKERS) as pool:
+        details_list = list(
+            pool.map(lambda p: get_playlist_details(p["id"], token), candidates)
+        )
+
+    for playlist, details in zip(candidates, details_list):
+        if details and "followers" in details:
+            followers = details["followers"]["total"]
+            if followers < min_followers:
+                continue
+            playlist["followers"] = followers
+            valid_playlists.append(playlist)
+
+    # Sort playlists by followers; a heap suffices when only the top K
+    # are wanted (O(N log K) instead of a full O(N log N) sort)
+    if top_k is not None:
+        sorted_playlists = heapq.nlargest(top_k, valid_playlists, key=itemgetter("followers"))
+    else:
+        sorted_playlists = sorted(valid_playlists, key=itemgetter("followers"), reverse=True)
+
+    # Debugging: Log sorted playlists (lazy %s formatting plus the level
+    # check keep this near-free when DEBUG is off)
+    if _log.isEnabledFor(logging.DEBUG):
+        _log.debug("Filtered and Sorted Playlists:")
+        for playlist in sorted_playlists:
+            _log.debug(
+                "%s - Followers: %d - Tracks: %d",
+                playlist["name"],
+                playlist.get("followers", 0),
+                playlist["tracks"]["total"],
+            )
 
     # Return only playlist IDs
     playlist_ids = [playlist["id"] for playlist in sorted_playlists]
     return playlist_ids
 
+@functools.lru_cache(maxsize=4096)
 def get_playlist_details(playlist_id, token):
     """
     Get detailed metadata for a Spotify playlist (including followers).
 
+    Results are cached in memory for the session and on disk for 24h.
+
     Args:
         playlist_id (str): Spotify playlist ID.
         token (str): Spotify API access token.
@@ -144,35 +292,126 @@ def get_playlist_details(playlist_id, token):
         dict: Detailed playlist metadata.
     """
     url = f"https://api.spotify.com/v1/playlists/{playlist_id}"
-    headers = {"Authorization": f"Bearer {token}"}
-    response = requests.get(url, headers=headers)
+    # Only request the fields the pipeline actually reads -- the full
+    # payload (images, owner profile, inlined tracks...) is 10-100x larger
+    params = {"fields": "id,name,description,followers.total"}
+
+    cached = _cache_get(_cache_key(url, params), _PLAYLIST_TTL)
+    if cached is not None:
+        return cached
+
+    headers = {}
+    prior_etag = _ETAG_CACHE.get(url)
+    if prior_etag is not None:
+        headers["If-None-Match"] = prior_etag[0]
+
+    response = _SESSION.get(url, params=params, headers=headers)
+
+    if response.status_code == 304:  # Not modified: reuse the parsed body
+        return prior_etag[1]
+
     if response.status_code == 200:
-        return response.json()
+        etag = response.headers.get("ETag")
+        if etag is None:
+            # No ETag: skip re-parsing if the body is byte-identical
+            digest = hashlib.blake2b(response.content, digest_size=16).digest()
+            prior = _DIGEST_CACHE.get(url)
+            if prior is not None and prior[0] == digest:
+                return prior[1]
+
+        details = orjson.loads(response.content)
+        if etag is not None:
+            _ETAG_CACHE[url] = (etag, details)
+        else:
+            _DIGEST_CACHE[url] = (digest, details)
+        _cache_set(_cache_key(url, params), details)
+        return details
     else:
-        print(f"Error fetching details for playlist {playlist_id}: {response.status_code}")
+        _log.warning(
+            "Error fetching details for playlist %s: %s", playlist_id, response.status_code
+        )
         return None
 
 ###########################################################
 # Function: get_playlist_tracks
-def get_playlist_tracks(playlist_id, token):
+def get_playlist_tracks(playlist_id, token, max_tracks=200):
     """
-    A function to get tracks from a Spotify playlist.
+    A function to get tracks from a Spotify playlist, following pagination.
 
     Params:
         playlist_id (str): Spotify playlist ID.
         token (str): Spotify API access token.
+        max_tracks (int): Maximum number of tracks to fetch (default 200).
 
     Returns:
-        dict: JSON response with playlist tracks.
+        dict: JSON response with playlist tracks; "items" spans all
+        fetched pages, up to max_tracks.
     """
     url = f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks"
-    headers = {"Authorization": f"Bearer {token}"}
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    return response.json()
+    # Trim each item down to the track name/id and artist names/ids --
+    # all that get_track_genres and the processing notebook consume
+    fields = "items(track(id,name,artists(id,name))),total,next"
+
+    cache_params = {"fields": fields, "max_tracks": max_tracks}
+    cached = _cache_get(_cache_key(url, cache_params), _PLAYLIST_TTL)
+    if cached is not None:
+        return cached
+
+    def _fetch_page(offset):
+        params = {"fields": fields, "limit": 100, "offset": offset}
+        response = _SESSION.get(url, params=params)
+        response.raise_for_status()
+        return orjson.loads(response.content)
+
+    tracks = _fetch_page(0)
+
+    # The first page reports the total, so any remaining pages can all
+    # be requested concurrently
+    total = min(tracks.get("total", 0), max_tracks)
+    offsets = range(100, total, 100)
+    if offsets:
+        with ThreadPoolExecutor(max_workers=_MAX_WORKERS) as pool:
+            for page in pool.map(_fetch_page, offsets):
+                tracks["items"].extend(page.get("items", []))
+
+    _cache_set(_cache_key(url, cache_params), tracks)
+    return tracks
 
 ###########################################################
 
+@functools.lru_cache(maxsize=4096)
+def _get_artists_batch(artist_ids, token):
+    """
+    Fetch the artist objects for a batch of up to 50 artist IDs.
+
+    `artist_ids` must be a tuple so the call is cacheable; responses are
+    cached in memory for the session and on disk for 7 days (artist
+    genres essentially never change).
+
+    Params:
+        artist_ids (tuple): Spotify artist IDs.
+        token (str): Spotify API access token.
+
+    Returns:
+        list: Artist objects from the /v1/artists endpoint, or None on error.
+    """
+    url = "https://api.spotify.com/v1/artists"
+    params = {"ids": ",".join(artist_ids)}
+
+    key = _cache_key(url, params)
+    cached = _cache_get(key, _ARTIST_TTL)
+    if cached is not None:
+        return cached["artists"]
+
+    response = _SESSION.get(url, params=params)
+
+    if response.status_code != 200:
+        return None
+
+    data = orjson.loads(response.content)
+    _cache_set(key, data)
+    return data["artists"]
+
 def get_track_genres(playlist_id, token):
     """
     Fetch genres for the first 200 tracks of a playlist using batched artist requests.
@@ -186,11 +425,14 @@ def get_track_genres(playlist_id, token):
     """
     playlist_tracks = get_playlist_tracks(playlist_id, token)
     if not playlist_tracks or "items" not in playlist_tracks:
-        print(f"No tracks found for playlist ID: {playlist_id}")
+        _log.warning("No tracks found for playlist ID: %s", playlist_id)
         return {}
 
     genres = {}
-    artist_ids = []  # Collect all artist IDs from the playlist
+    # Map each artist ID to every track name it appears on; dict
+    # insertion order doubles as the deduplicated ID list, so an artist
+    # repeated across many tracks is only fetched once
+    artist_id_to_tracks = {}
 
     for item in playlist_tracks["items"][:200]:  # Limit to 200 tracks
         track = item.get("track")
@@ -198,42 +440,33 @@ def get_track_genres(playlist_id, token):
             continue
 
         track_name = track.get("name")
-        track_artists = [
-            {"name": artist["name"], "id": artist["id"], "track": track_name}
-            for artist in track.get("artists", [])
-            if "id" in artist
-        ]
-        artist_ids.extend(track_artists)  # Collect artists with associated track names
-
-    # Batch artist IDs into groups of 50
-    for i in range(0, len(artist_ids), 50):
-        batch = artist_ids[i:i + 50]
-        artist_id_str = ",".join([artist["id"] for artist in batch if artist["id"]])
-        url = "https://api.spotify.com/v1/artists"
-        headers = {"Authorization": f"Bearer {token}"}
-        params = {"ids": artist_id_str}
-
-        response = requests.get(url, headers=headers, params=params)
-
-        if response.status_code == 429:  # Handle rate-limiting
-            retry_after = int(response.headers.get("Retry-After", 60))
-            print(f"Rate limit hit. Retrying after {retry_after} seconds...")
-            time.sleep(retry_after)
-            continue
-        
-        if response.status_code == 200:
-            data = response.json()["artists"]
+        for artist in track.get("artists", []):
+            artist_id = artist.get("id")
+            if artist_id:
+                artist_id_to_tracks.setdefault(artist_id, []).append(track_name)
+
+    # Batch the unique artist IDs into groups of 50 and fetch concurrently
+    unique_artist_ids = list(artist_id_to_tracks)
+    batches = [
+        tuple(unique_artist_ids[i:i + 50])
+        for i in range(0, len(unique_artist_ids), 50)
+    ]
+
+    with ThreadPoolExecutor(max_workers=_MAX_WORKERS) as pool:
+        artist_batches = list(pool.map(lambda b: _get_artists_batch(b, token), batches))
+
+    for data in artist_batches:
+        if data is not None:
             for artist in data:
                 if artist is None:  # Check if artist is None before accessing its attributes
-                    print("Warning: Found NoneType artist in the response")
+                    _log.warning("Found NoneType artist in the response")
                     continue
 
-                artist_name = artist.get("name", "Unknown Artist")
                 artist_genres = artist.get("genres", [])
-                for artist_info in batch:
-                    if artist_info["id"] == artist.get("id"):  # Use .get() to avoid KeyError
-                        genres[artist_info["track"]] = artist_genres
-    
+                for track_name in artist_id_to_tracks.get(artist.get("id"), []):
+                    # Accumulate genres across a track's co-artists
+                    genres.setdefault(track_name, []).extend(artist_genres)
+
     return genres
 
 ###########################################################
@@ -248,15 +481,19 @@ def save_json(data, filename, folder=None):
         folder (str): Folder path to save the file
     """
     if folder is None:
-        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        folder = os.path.join(base_dir, "data/raw")
-    
-    # Ensure the directory exists
-    os.makedirs(folder, exist_ok=True)
-
-    # Save the JSON file
-    with open(f"{folder}/{filename}.json", "w") as f:
-        json.dump(data, f, indent=4)
+        folder = _DEFAULT_RAW_DIR
+    folder = Path(folder)
+
+    # Ensure the directory exists -- one mkdir per distinct folder,
+    # rather than a stat+mkdir syscall pair on every call
+    if folder not in _created_dirs:
+        folder.mkdir(parents=True, exist_ok=True)
+        _created_dirs.add(folder)
+
+    # Save the JSON file -- orjson serializes into one contiguous
+    # buffer, so write the bytes directly in one go
+    with open(folder / f"{filename}.json", "wb") as f:
+        f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
 
 ###########################################################
 